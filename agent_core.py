@@ -1,25 +1,262 @@
-import json
-import logging
+import asyncio
+import atexit
 import concurrent.futures
+import copy
+import functools
+import logging
+import threading
 import time
-from typing import Dict, List, Any, Optional
+from collections import Counter
+from typing import AbstractSet, Awaitable, Callable, Dict, Iterable, List, Any, Optional, Tuple, TypedDict, TypeVar
 
 import google.generativeai as genai
+import orjson
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
+from curriculum_manager import validate_graph
+from response_cache import SemanticCache, canonicalize, normalize, prompt_key, shared_cache
+
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "models/text-embedding-004"
+# Small-context agents (a risk score and a short reason) run on a cheaper, lower-latency model.
+DEFAULT_LIGHT_MODEL = "gemini-2.5-flash-lite"
+LIGHT_AGENTS = frozenset({'verifier'})
+
+T = TypeVar("T")
+
+PartialCallback = Callable[[Dict[str, Any]], None]
+# Returns a reason the (complete) result is unusable, or None; unusable results become errors and are never cached.
+Validator = Callable[[Dict[str, Any]], Optional[str]]
+
+# Compact output keys requested from Gemini (fewer input and decode tokens, multiplied across
+# 10 quiz items), expanded back to the app-facing names at the _generate_structured boundary.
+KEY_MAP: Dict[str, str] = {
+    'content_text': 'c',
+    'latex_equation': 'l',
+    'latex_reason': 'lr',
+    'quiz_items': 'q',
+    'question': 'qt',
+    'options': 'o',
+    'correct_option_index': 'ci',
+    'explanation': 'e',
+    'risk_score': 'r',
+    'flagged_reason': 'fr',
+    'remedial_node_id': 'ri',
+    'remedial_node_label': 'rl',
+}
+INVERSE_KEY_MAP: Dict[str, str] = {short: full for full, short in KEY_MAP.items()}
+
+def rename_keys(data: Any, mapping: Dict[str, str]) -> Any:
+    """Recursively renames dict keys found in 'mapping', leaving other keys untouched."""
+    if isinstance(data, dict):
+        return {mapping.get(k, k): rename_keys(v, mapping) for k, v in data.items()}
+    if isinstance(data, list):
+        return [rename_keys(v, mapping) for v in data]
+    return data
+
+# Output schemas passed as response_schema, so Gemini enforces the shape at decode time.
+class GraphNode(TypedDict):
+    id: str
+    label: str
+
+class GraphEdge(TypedDict):
+    source: str
+    target: str
+
+class ArchitectOut(TypedDict):
+    nodes: List[GraphNode]
+    edges: List[GraphEdge]
+
+class QuizItem(TypedDict):
+    qt: str  # question
+    o: List[str]  # options
+    ci: int  # correct_option_index
+    e: str  # explanation
+
+class ModuleOut(TypedDict):
+    """Structured output of the fused Module Builder call (Professor + LaTeX + Proctor)."""
+    c: str  # content_text
+    l: str  # latex_equation
+    lr: str  # latex_reason
+    q: List[QuizItem]  # quiz_items
+
+class VerifierOut(TypedDict):
+    r: float  # risk_score
+    fr: str  # flagged_reason
+
+class EvaluatorOut(TypedDict):
+    ri: str  # remedial_node_id
+    rl: str  # remedial_node_label
+    reason: str
+
+# Stable per-agent instructions, bound once per pooled model as its system instruction; each call only
+# sends the dynamic tail (topic, node label, LTM). At a few hundred tokens they are below Gemini's
+# context-caching minimum, so they are billed as regular input on every call.
+AGENT_PREAMBLES: Dict[str, str] = {
+    'architect': """You are a Curriculum Architect for Higher Education. Build a DAG of learning concepts for the topic.
+- nodes: 5-8 concepts, each with unique string id and label; start from foundational concepts.
+- edges: source is the prerequisite, target the advanced concept.
+JSON: {"nodes":[{"id":"c1","label":"Concept Name"}],"edges":[{"source":"c1","target":"c2"}]}""",
+    'module': """You are a Module Builder with three roles for the given concept.
+1. Professor (c): tailored lecture, ~300 words, concise, undergraduate rigor, referencing a key formula.
+The LTM tag MUST be used: "FAIL:<concepts>|N=<count>" means the student recently failed those concepts
+(N failed attempts), so focus on foundational gaps with detailed examples and analogies; "STRONG" means a
+strong track record, so be concise and move quickly to application; "NONE" means no prior history.
+2. Formula Generator (l, lr): the most relevant equation in LaTeX (e.g. \\frac{d}{dx} x^2 = 2x) and why;
+empty strings if none is relevant.
+3. Proctor (q): 10 distinct multiple-choice questions testing deep understanding, each with question qt,
+four options o ("A) ...".."D) ..."), correct index ci, explanation e.
+JSON: {"c":"...","l":"...","lr":"...","q":[{"qt":"...","o":["A) ...","B) ...","C) ...","D) ..."],"ci":0,"e":"..."}]}""",
+    'verifier': """You are a Content Auditor. Rate the academic confidence and factual certainty of the given lecture
+as a Hallucination Risk Score r from 0.0 (no risk) to 1.0 (high risk). fr: why r is above 0.3,
+or 'Content is highly factual'.
+JSON: {"r":0.0,"fr":"..."}""",
+    'evaluator': """You are a Learning Evaluator. A student failed the quiz for a concept. Identify a SPECIFIC single
+missing prerequisite concept rl explaining the failure, with a brief reason. ri is the remedial id given.
+JSON: {"ri":"...","rl":"Name of the sub-concept","reason":"..."}""",
+}
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Returns the process-wide event loop that owns the Gemini async clients."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="gemini-loop", daemon=True).start()
+            atexit.register(_loop.call_soon_threadsafe, _loop.stop)
+    return _loop
+
+def submit(coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+    """
+    Schedules an agent coroutine on the background loop and returns a thread-safe future.
+    A single long-lived loop is used because the async gRPC client is bound to the loop it was created on.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop())
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """Runs an agent coroutine to completion from synchronous (Streamlit) code."""
+    return submit(coro).result()
+
+#  STREAMING JSON REPAIR 
+
+def repair_json(buffer: str) -> str:
+    """
+    Closes a truncated JSON document in a single pass: terminates an open string and
+    closes pending objects/arrays. If the tail is not a complete value (dangling key,
+    partial literal), it is cut back to the last point where the document was valid.
+    """
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    # (cut index, closers) pairs at which the prefix can be closed into valid JSON
+    safe_points: List[Tuple[int, str]] = []
+
+    for i, ch in enumerate(buffer):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            safe_points.append((i + 1, ''.join(reversed(stack))))
+        elif ch in '}]':
+            if stack:
+                stack.pop()
+        elif ch == ',':
+            safe_points.append((i, ''.join(reversed(stack))))
+
+    tail = buffer
+    if in_string:
+        if escape:
+            tail = tail[:-1]
+        tail += '"'
+    tail = tail.rstrip()
+    if tail.endswith(','):
+        tail = tail[:-1]
+    elif tail.endswith(':'):
+        tail += 'null'
+    candidate = tail + ''.join(reversed(stack))
+
+    for cut, closers in [(None, None)] + safe_points[::-1]:
+        if cut is not None:
+            candidate = buffer[:cut] + closers
+        try:
+            orjson.loads(candidate)
+            return candidate
+        except orjson.JSONDecodeError:
+            continue
+    return candidate
+
+def parse_partial_json(buffer: str) -> Optional[Dict[str, Any]]:
+    """Best-effort parse of an in-progress JSON object stream."""
+    try:
+        data = orjson.loads(repair_json(buffer))
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+#  MODEL POOL 
+
+_configured_api_key: Optional[str] = None
+_configure_lock = threading.Lock()
+
+def _configure(api_key: str) -> bool:
+    """
+    Configures the process-global genai client only when the key changes; a new key invalidates pooled models.
+    Returns True when the client was (re)configured.
+    """
+    global _configured_api_key
+    with _configure_lock:
+        if api_key == _configured_api_key:
+            return False
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+        _get_agent_model.cache_clear()
+        return True
+
+async def _warm_channel(model_name: str):
+    """
+    Opens the async gRPC (HTTP/2) channel on the background loop ahead of the first agent call.
+    Every agent call uses the *_async methods, i.e. genai's grpc_asyncio clients created once on this loop,
+    so all streams already share that channel; no global transport override is needed.
+    """
+    await genai.GenerativeModel(model_name).count_tokens_async("warmup")
+
+def _log_warmup_failure(future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Gemini channel warm-up failed: %s", future.exception())
+
+@functools.lru_cache(maxsize=16)
+def _get_agent_model(model_name: str, agent: str) -> genai.GenerativeModel:
+    """Pooled model with the agent's stable preamble bound as its system instruction."""
+    return genai.GenerativeModel(model_name, system_instruction=AGENT_PREAMBLES[agent])
+
 class AgentCore:
     """
     Orchestrates Gemini API interactions using multi-agent patterns (Parallel and Sequential).
     Implements Custom Tools (LaTeX Agent), Agent Evaluation (Verifier Agent), and A2A Protocol.
     """
-    def __init__(self, api_key: str, model_name: str):
+    def __init__(self, api_key: str, model_name: str, light_model_name: str = DEFAULT_LIGHT_MODEL,
+                 response_cache: Optional[SemanticCache] = None):
         if not api_key:
             raise ValueError("API Key is required.")
         
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name) 
+        configured = _configure(api_key)
+        self.model_name = model_name
+        self.light_model_name = light_model_name
+        if configured:
+            # Pay the TLS handshake off the critical path of the first module.
+            submit(_warm_channel(self.model_name)).add_done_callback(_log_warmup_failure)
         self.safety_settings = {
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
             HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
@@ -27,179 +264,241 @@ class AgentCore:
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
         }
         self.latency_metrics: Dict[str, float] = {}
+        self.response_cache = response_cache if response_cache is not None else shared_cache
+        self.cache_metrics: Dict[str, int] = {'hits': 0, 'misses': 0}
+        # Single-flight registry: identical in-flight requests (double clicks, prefetch vs. click) share one call.
+        self._inflight: Dict[str, concurrent.futures.Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    def _model_name_for(self, agent: str) -> str:
+        """Routes light agents to the small model and everything else to the selected model."""
+        return self.light_model_name if agent in LIGHT_AGENTS else self.model_name
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        """Returns a unit-length embedding for semantic cache lookups, or None on failure."""
+        try:
+            result = await genai.embed_content_async(model=EMBEDDING_MODEL, content=text, task_type="semantic_similarity")
+            return normalize(result['embedding'])
+        except Exception as e:
+            logger.warning("Embedding failed, bypassing semantic cache: %s", e)
+            return None
+
+    async def _generate_structured(self, agent: str, prompt: str, schema: type, cache_text: Optional[str] = None,
+                                   cache_scope: str = "", cache_exclude: AbstractSet[str] = frozenset(),
+                                   on_partial: Optional[PartialCallback] = None,
+                                   validate: Optional[Validator] = None) -> Dict[str, Any]:
+        """Coalesces identical concurrent requests so only the first reaches the cache/Gemini."""
+        flight_key = "%s:%s:%s" % (agent, self._model_name_for(agent), prompt_key(prompt))
+        with self._inflight_lock:
+            leader = self._inflight.get(flight_key)
+            if leader is None:
+                future: concurrent.futures.Future = concurrent.futures.Future()
+                self._inflight[flight_key] = future
+
+        if leader is not None:
+            logger.info("Coalesced duplicate in-flight %s request.", agent)
+            return copy.deepcopy(await asyncio.wrap_future(leader))
 
-    def _generate_json(self, prompt: str) -> Dict[str, Any]:
-        """Handles JSON generation and robust output sanitization."""
+        try:
+            result = await self._generate_cached(agent, prompt, schema, cache_text, cache_scope, cache_exclude,
+                                                 on_partial, validate)
+            # Followers get a snapshot: callers may mutate their result (e.g. the evaluator's A2A label prefix)
+            future.set_result(copy.deepcopy(result))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[flight_key]
+        return result
+
+    async def _generate_cached(self, agent: str, prompt: str, schema: type, cache_text: Optional[str],
+                               cache_scope: str, cache_exclude: AbstractSet[str],
+                               on_partial: Optional[PartialCallback],
+                               validate: Optional[Validator] = None) -> Dict[str, Any]:
+        """
+        Serves from the semantic cache when possible, otherwise calls the agent's Gemini model.
+        'prompt' is only the dynamic tail; the agent preamble is already bound to the model.
+        'cache_text' is the part of the request embedded for similarity matching;
+        'cache_scope' must match exactly for a semantic hit, and entries embedded from a
+        (canonical) text in 'cache_exclude' are never served as a semantic hit.
+        'validate' rejects unusable responses before they can be cached.
+        Both the exact key and the scope include the model, so switching models never serves another model's output.
+        """
+        if not self.response_cache.enabled(agent):
+            return await self._call_validated(agent, prompt, schema, on_partial, validate)
+
+        model_name = self._model_name_for(agent)
+        key = "%s:%s" % (model_name, prompt_key(prompt))
+        cache_scope = "%s|%s" % (model_name, cache_scope)
+        cached = self.response_cache.get_exact(agent, key)
+        embedding = None
+        text = canonicalize(cache_text or prompt)
+        if cached is None:
+            embedding = await self._embed(text)
+            if embedding is not None:
+                cached = self.response_cache.get_similar(agent, embedding, cache_scope, cache_exclude)
+
+        if cached is not None:
+            self.cache_metrics['hits'] += 1
+            logger.info("Semantic cache hit (%s).", agent)
+            return cached
+
+        self.cache_metrics['misses'] += 1
+        result = await self._call_validated(agent, prompt, schema, on_partial, validate)
+        if embedding is not None:
+            self.response_cache.put(agent, key, embedding, result, cache_scope, text)
+        return result
+
+    async def _call_validated(self, agent: str, prompt: str, schema: type, on_partial: Optional[PartialCallback],
+                              validate: Optional[Validator]) -> Dict[str, Any]:
+        """Calls Gemini and turns a result that fails 'validate' into an error dict (so it is not cached)."""
+        result = await self._call_gemini_structured(agent, prompt, schema, on_partial)
+        if validate is not None and "error" not in result:
+            problem = validate(result)
+            if problem:
+                logger.error("%s output rejected: %s", agent, problem)
+                return {"error": problem}
+        return result
+
+    async def _call_gemini_structured(self, agent: str, prompt: str, schema: type,
+                                      on_partial: Optional[PartialCallback] = None) -> Dict[str, Any]:
+        """
+        Streams schema-constrained JSON generation, reporting repaired partial objects to
+        'on_partial' as chunks arrive, then validates the complete text.
+        """
         
         tools = None 
-        generation_config = genai.GenerationConfig(response_mime_type="application/json")
+        generation_config = genai.GenerationConfig(response_mime_type="application/json", response_schema=schema)
+        buffer = ""
         
         try:
-            response = self.model.generate_content(
+            response = await _get_agent_model(self._model_name_for(agent), agent).generate_content_async(
                 prompt,
                 generation_config=generation_config,
                 safety_settings=self.safety_settings,
-                tools=tools
+                tools=tools,
+                stream=True
             )
-            raw_data = json.loads(response.text)
-            
-            # Sanitization: Handle cases where model wraps JSON object in a list
-            if isinstance(raw_data, list) and len(raw_data) > 0 and isinstance(raw_data[0], dict):
-                raw_data = raw_data[0]
+            async for chunk in response:
+                buffer += chunk.text
+                if on_partial:
+                    partial = parse_partial_json(buffer)
+                    if partial:
+                        on_partial(rename_keys(partial, INVERSE_KEY_MAP))
+
+            raw_data = orjson.loads(buffer)
             
             if isinstance(raw_data, dict):
-                return raw_data
+                return rename_keys(raw_data, INVERSE_KEY_MAP)
             
             logger.error("LLM returned unexpected type: %s", type(raw_data))
             return {"error": "LLM returned non-dictionary structure."}
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error("JSON Decoding Failed: %s", e)
-            return {"error": "LLM returned invalid JSON: %s..." % response.text[:100]}
+            return {"error": "LLM returned invalid JSON: %s..." % buffer[:100]}
         except Exception as e:
             logger.error("LLM Generation Failed (Unknown Error): %s", e)
             return {"error": str(e)}
 
     #  CURRICULUM ARCHITECT 
-    def architect_agent(self, topic: str, user_context: str) -> Dict[str, Any]:
+    async def architect_agent(self, topic: str, user_context: str) -> Dict[str, Any]:
         """Generates the initial dependency graph structure."""
         logger.info("Architect Agent activated for topic: %s", topic)
         
         prompt = f"""
-        You are a Curriculum Architect for Higher Education. Based on the topic, determine the core 
-        prerequisite structure.
         Topic: {topic}
         Context: {user_context}
-
-        Task: Create a directed acyclic graph (DAG) of learning concepts for this topic.
-        
-        Requirements:
-        1. 'nodes': A list of concepts. Each must have a unique 'id' (string) and a 'label' (string).
-        2. 'edges': A list of dependencies where 'source' is the prerequisite and 'target' is the advanced concept.
-        3. Keep it between 5-8 nodes for a manageable session.
-        4. Ensure the graph starts with foundational concepts.
-
-        Output JSON format:
-        {{
-            "nodes": [{{"id": "c1", "label": "Concept Name"}}],
-            "edges": [{{"source": "c1", "target": "c2"}}]
-        }}
-        """
-        return self._generate_json(prompt)
-
-    #  CUSTOM TOOL - LATEX GENERATOR 
-    def _latex_agent_task(self, node_label: str) -> Dict[str, str]:
-        """Generates a relevant LaTeX equation or formula."""
-        prompt = f"""
-        You are a Formula Generator. For the concept '{node_label}', identify the most important 
-        mathematical or scientific equation. If one is highly relevant, provide it in LaTeX.
-        If not relevant, return empty.
-        
-        Output JSON: {{"latex_equation": "Your LaTeX code here (e.g., \\frac{{d}}{{dx}} x^2 = 2x )", "reason": "why this formula is relevant"}}
         """
-        return self._generate_json(prompt)
+        return await self._generate_structured('architect', prompt, ArchitectOut, cache_text=topic, cache_scope=user_context,
+                                               validate=validate_graph)
 
     # EVALUATION - VERIFIER AGENT (Sequential) 
-    def _verifier_agent_task(self, lecture_content: str) -> Dict[str, Any]:
+    async def _verifier_agent_task(self, lecture_content: str) -> Dict[str, Any]:
         """Sequential Agent that checks confidence (Hallucination Warning Metric)."""
         prompt = f"""
-        You are a Content Auditor. Evaluate the academic confidence and factual certainty of the 
-        following lecture material.
-
         Lecture: {lecture_content}
-
-        Task: Assign a Hallucination Risk Score from 0.0 (No Risk/High Confidence) to 1.0 (High Risk/Low Confidence).
-        
-        Output JSON: 
-        {{
-            "risk_score": 0.0 (float),
-            "flagged_reason": "Briefly state why the score is above 0.3, or 'Content is highly factual' otherwise."
-        }}
         """
-        return self._generate_json(prompt)
+        return await self._generate_structured('verifier', prompt, VerifierOut)
 
-    # AGENT 4: PROFESSOR AGENT (LTM CONSUMER)
-    def _content_agent_task(self, node_label: str, ltm_history: List[Dict[str, Any]]) -> Dict[str, str]:
+    @staticmethod
+    def _summarize_ltm(ltm_history: List[Dict[str, Any]]) -> str:
         """
-        Generates lecture content, tailoring it based on the user's LTM.
+        Condenses the user's LTM into a bounded tag (interpreted by the Module Builder preamble):
+        the top-3 most frequent failures, sorted, plus the failure count.
         """
-        history_summary = "No significant prior history found."
+        history_summary = "NONE"
         if ltm_history:
             failed_nodes = [h['node'] for h in ltm_history if h['status'] == 'INCORRECT']
             success_count = len([h for h in ltm_history if h['status'] == 'CORRECT'])
             
             if failed_nodes:
-                history_summary = f"Student has recently struggled/failed on related concepts: {', '.join(set(failed_nodes))}. Focus the explanation on foundational gaps."
+                top_failures = sorted(node for node, _ in Counter(failed_nodes).most_common(3))
+                history_summary = "FAIL:%s|N=%d" % (",".join(top_failures), len(failed_nodes))
             elif success_count >= 3:
-                 history_summary = "Student has a strong track record. Ensure the explanation is concise and moves quickly to application."
+                history_summary = "STRONG"
+        return history_summary
 
-        prompt = f"""
-        You are a Professor. Your goal is to write a tailored lecture.
-
-        LTM CONTEXT (MUST USE THIS): {history_summary}
-
-        Explain the concept '{node_label}' clearly and concisely (approx 300 words).
-        Focus on academic rigor suitable for undergraduates. Integrate a reference to a key formula.
-        
-        If the LTM CONTEXT indicates struggle, use more detailed examples and analogies.
-        
-        Output JSON: {{"content_text": "YOUR_EXPLANATION"}}
+    # AGENTS 3-5: MODULE BUILDER (Professor + Custom Tool LaTeX + Proctor, LTM CONSUMER)
+    async def _module_agent_task(self, node_label: str, ltm_history: List[Dict[str, Any]],
+                                 on_partial: Optional[PartialCallback] = None, topic: str = "",
+                                 sibling_labels: Iterable[str] = ()) -> Dict[str, Any]:
         """
-        return self._generate_json(prompt)
+        Generates the tailored lecture, key formula, and 10-question quiz in a single structured call.
+        Semantic cache hits are limited to the same topic and LTM tag, and never return content
+        generated for another concept of the same curriculum (e.g. "First Law" vs. "Second Law").
+        """
+        history_summary = self._summarize_ltm(ltm_history)
+        own_label = canonicalize(node_label)
+        siblings = frozenset(canonicalize(label) for label in sibling_labels) - {own_label}
 
-    # AGENT 5: PROCTOR AGENT (10-Question Quiz) 
-    def _quiz_agent_task(self, node_label: str) -> Dict[str, Any]:
-        """Generates the quiz questions and answer key (10 questions)."""
         prompt = f"""
-        You are a Proctor. Create ten (10) distinct multiple-choice questions to test deep understanding of '{node_label}'.
-        Each question must have four options (A, B, C, D) and one correct answer index.
-
-        Output JSON must be a single object containing a list of 10 quiz items:
-        {{
-            "quiz_items": [
-                {{"question": "Q1 text", "options": ["A) ...", "B) ...", "C) ...", "D) ..."], "correct_option_index": 0, "explanation": "Why correct"}},
-                // ... 9 more items ...
-            ]
-        }}
+        Topic: {topic}
+        Concept: {node_label}
+        LTM: {history_summary}
         """
-        return self._generate_json(prompt)
+        return await self._generate_structured('module', prompt, ModuleOut, cache_text=node_label,
+                                               cache_scope="%s|%s" % (topic, history_summary),
+                                               cache_exclude=siblings, on_partial=on_partial)
 
-    #  PARALLEL EXECUTION FLOW (Core Capstone Demonstration) 
-    def parallel_content_generation(self, node_label: str, ltm_history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    #  CONTENT GENERATION FLOW (Core Capstone Demonstration) 
+    async def parallel_content_generation(self, node_label: str, ltm_history: List[Dict[str, Any]],
+                                          on_partial: Optional[PartialCallback] = None, topic: str = "",
+                                          sibling_labels: Iterable[str] = ()) -> Dict[str, Any]:
         """
-        Executes Professor, Proctor, and LaTeX agents in parallel, followed by the Verifier Agent sequentially.
+        Runs the fused Module Builder (Professor, LaTeX, and Proctor roles in one round-trip),
+        followed by the Verifier Agent sequentially, since the audit depends on the lecture.
+        'on_partial' receives the in-progress Module Builder output while it streams.
+        'topic' and 'sibling_labels' (the curriculum's node labels) scope the response cache.
         """
-        logger.info("Starting parallel execution for node: %s", node_label)
+        logger.info("Starting module generation for node: %s", node_label)
         start_time = time.time()
 
-        # Parallel Tasks: Content, Quiz, and Custom Tool (LaTeX)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            future_content = executor.submit(self._content_agent_task, node_label, ltm_history)
-            future_quiz = executor.submit(self._quiz_agent_task, node_label)
-            future_latex = executor.submit(self._latex_agent_task, node_label)
-            
-            content_result = future_content.result()
-            quiz_result = future_quiz.result()
-            latex_result = future_latex.result()
+        module_result = await self._module_agent_task(node_label, ltm_history, on_partial, topic, sibling_labels)
 
         # Sequential Task: Verifier Agent (Agent Evaluation)
-        verifier_result = self._verifier_agent_task(content_result.get("content_text", ""))
+        verifier_result = await self._verifier_agent_task(module_result.get("content_text", ""))
         
         latency = time.time() - start_time
         
-        # P3: Store Observability metric
-        self.latency_metrics[node_label] = latency
+        # P3: Store Observability metric. Copy-on-write: this runs on the agent loop while the
+        # Streamlit thread may be iterating the current dict.
+        self.latency_metrics = {**self.latency_metrics, node_label: latency}
         logger.info("P3 Trace: Multi-step content generation for %s took %.2f seconds.", node_label, latency)
 
         return {
-            "lecture": content_result.get("content_text", "Error generating content."),
-            "quiz_items": quiz_result.get("quiz_items", []),
-            "latex": latex_result,
+            "lecture": module_result.get("content_text", "Error generating content."),
+            "quiz_items": module_result.get("quiz_items", []),
+            "latex": {
+                "latex_equation": module_result.get("latex_equation", ""),
+                "reason": module_result.get("latex_reason", "")
+            },
             "verifier_audit": verifier_result
         }
 
     #  AGENT 6: EVALUATOR AGENT (A2A Protocol Consumer) 
-    def evaluator_agent(self, node_label: str, user_score_percentage: float, verifier_audit: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def evaluator_agent(self, node_label: str, user_score_percentage: float, verifier_audit: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
         Decides on remedial action after quiz failure. Consumes A2A signal from Verifier Agent.
         """
@@ -219,18 +518,12 @@ class AgentCore:
             logger.warning("A2A Protocol: Verifier flagged high risk (%.2f). Modifying remediation.", risk_score)
 
         prompt = f"""
-        The student scored {user_score_percentage*100:.0f}% on the quiz for '{node_label}', indicating a knowledge gap.
-        Identify a SPECIFIC single missing prerequisite concept that explains this failure.
-        
-        Output JSON:
-        {{
-            "remedial_node_id": "remedial_{node_label.replace(' ', '_')}",
-            "remedial_node_label": "Name of the sub-concept",
-            "reason": "Brief reason why this is needed."
-        }}
+        Concept: {node_label}
+        Quiz score: {user_score_percentage*100:.0f}%
+        Remedial id: remedial_{node_label.replace(' ', '_')}
         """
         
-        remedial_plan = self._generate_json(prompt)
+        remedial_plan = await self._generate_structured('evaluator', prompt, EvaluatorOut)
         
         # Apply A2A modification to the label
         if 'remedial_node_label' in remedial_plan:
@@ -1,13 +1,15 @@
 import streamlit as st
-import time
+import collections
+import functools
 import json
 import logging
 import os
+import queue
 from typing import Dict, List, Any, Optional
 
 from firebase_admin import credentials, initialize_app, firestore
 from firebase_admin import auth as firebase_auth
-from agent_core import AgentCore
+from agent_core import AgentCore, run_sync, submit
 from curriculum_manager import CurriculumManager
 
 #  CONFIGURATION & LOGGING 
@@ -16,13 +18,21 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 DEFAULT_MODEL = 'gemini-2.5-flash-preview-09-2025' 
 PASS_THRESHOLD = 0.70 
+PREFETCH_DEPTH = 1
+LTM_CACHE_TTL = 60
+HISTORY_LIMIT = 50
 
 #  FIREBASE INTEGRATION (P1: Persistence & LTM) 
 
+@st.cache_resource
+def _get_firestore_client() -> firestore.client:
+    """Process-wide Firestore client, created once the Firebase app is initialized."""
+    return firestore.client()
+
 def init_firebase() -> tuple[Optional[firestore.client], str]:
     """Initializes Firebase Admin SDK and authenticates the user."""
     if 'firebase_initialized' in st.session_state and st.session_state.firebase_initialized:
-        db = firestore.client()
+        db = _get_firestore_client()
         return db, st.session_state.user_id
 
     try:
@@ -39,7 +49,7 @@ def init_firebase() -> tuple[Optional[firestore.client], str]:
             cred = credentials.Certificate(firebase_config)
             initialize_app(cred)
 
-        db = firestore.client()
+        db = _get_firestore_client()
         
         user_id = "anonymous"
         if auth_token:
@@ -58,13 +68,19 @@ def init_firebase() -> tuple[Optional[firestore.client], str]:
         logger.error("Fatal Firebase Initialization Error: %s", e)
         return None, None
 
-def get_session_doc_ref(db: firestore.client, user_id: str, topic: str):
-    """Returns the document reference for the current curriculum session."""
-    app_id = st.session_state.get('app_id', 'default-app-id')
+def _current_app_id() -> str:
+    return st.session_state.get('app_id', 'default-app-id')
+
+@functools.lru_cache(maxsize=128)
+def _session_doc_ref(db: firestore.client, app_id: str, user_id: str, topic: str):
     topic_doc_id = topic.lower().replace(' ', '_').replace('/', '_')
     collection_path = f"artifacts/{app_id}/users/{user_id}/curriculum_sessions"
     return db.collection(collection_path).document(topic_doc_id)
 
+def get_session_doc_ref(db: firestore.client, user_id: str, topic: str):
+    """Returns the (memoized) document reference for the current curriculum session."""
+    return _session_doc_ref(db, _current_app_id(), user_id, topic)
+
 def load_curriculum_state(db: firestore.client, user_id: str, topic: str) -> Optional[CurriculumManager]:
     """Loads curriculum state from Firestore."""
     try:
@@ -85,55 +101,172 @@ def save_curriculum_state(db: firestore.client, user_id: str, manager: Curriculu
     try:
         doc_ref = get_session_doc_ref(db, user_id, manager.topic)
         doc_ref.set(manager.serialize())
+        manager.clear_deltas()
         logger.info("P1 Trace: State saved to Firestore.")
     except Exception as e:
         logger.error("Failed to save state to Firestore: %s", e)
 
+def _stage_curriculum_write(batch, doc_ref, manager: CurriculumManager):
+    """Adds the curriculum write to a batch: the full document the first time, only changed fields afterwards."""
+    delta = manager.serialize_delta()
+    if delta is None:
+        batch.set(doc_ref, manager.serialize())
+        return
+
+    updates = {}
+    for field in ('nodes', 'adjacency'):
+        for node_id, value in delta[field + '_update'].items():
+            # FieldPath quoting keeps node ids containing dots or backticks from splitting the path.
+            updates[firestore.FieldPath(field, node_id).to_api_repr()] = value
+    if delta['completed_arrayUnion']:
+        updates['completed_nodes'] = firestore.ArrayUnion(delta['completed_arrayUnion'])
+    if updates:
+        batch.update(doc_ref, updates)
+
 #  LTM (Long-Term Memory) Helpers 
 
-def get_ltm_collection_ref(db: firestore.client, user_id: str):
-    """Returns the collection reference for quiz attempts."""
-    app_id = st.session_state.get('app_id', 'default-app-id')
+@functools.lru_cache(maxsize=128)
+def _ltm_collection_ref(db: firestore.client, app_id: str, user_id: str):
     ltm_collection_path = f"artifacts/{app_id}/users/{user_id}/quiz_attempts"
     return db.collection(ltm_collection_path)
 
-def log_quiz_attempt(db: firestore.client, user_id: str, node_id: str, is_correct: bool):
-    """Logs the result of a quiz attempt to the LTM database."""
+def get_ltm_collection_ref(db: firestore.client, user_id: str):
+    """Returns the (memoized) collection reference for quiz attempts."""
+    return _ltm_collection_ref(db, _current_app_id(), user_id)
+
+def commit_quiz_result(db: firestore.client, user_id: str, node_id: str, is_correct: bool, manager: CurriculumManager):
+    """Logs the quiz attempt to the LTM database and saves the curriculum changes in one batched write."""
+    if not is_correct:
+        # A failure changes the learner's LTM tag, so content prefetched for the old tag is stale.
+        discard_prefetches()
     if not db: 
         return
     try:
-        ltm_ref = get_ltm_collection_ref(db, user_id)
-        ltm_ref.add({
+        batch = db.batch()
+        batch.set(get_ltm_collection_ref(db, user_id).document(), {
             'timestamp': firestore.SERVER_TIMESTAMP,
             'node_id': node_id,
-            'topic': st.session_state.curriculum.topic,
+            'topic': manager.topic,
             'status': 'CORRECT' if is_correct else 'INCORRECT'
         })
+        if manager.topic:
+            _stage_curriculum_write(batch, get_session_doc_ref(db, user_id, manager.topic), manager)
+        batch.commit()
+        manager.clear_deltas()
+        # Only this learner's entry is stale; other users' cached histories stay warm.
+        _fetch_ltm.clear(db, _current_app_id(), user_id, manager.topic)
         logger.info("LTM Trace: Logged attempt for %s: %s", node_id, is_correct)
+        logger.info("P1 Trace: State saved to Firestore.")
     except Exception as e:
-        logger.error("Failed to log LTM: %s", e)
+        logger.error("Failed to commit quiz result: %s", e)
+
+@st.cache_data(ttl=LTM_CACHE_TTL, show_spinner=False)
+def _fetch_ltm(_db: firestore.client, app_id: str, user_id: str, topic: str) -> List[Dict[str, Any]]:
+    """
+    Queries the last N quiz attempts for the topic. Cached per (app, user, topic), so every input
+    of the query is part of the cache key; the entry is cleared when that user logs an attempt.
+    """
+    ltm_ref = _ltm_collection_ref(_db, app_id, user_id)
+    query = ltm_ref.where('topic', '==', topic).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(10)
+    
+    docs = query.stream()
+    history = []
+    for doc in docs:
+        data = doc.to_dict()
+        history.append({
+            'node': data.get('node_id'),
+            'status': data.get('status')
+        })
+    return history
 
 def get_ltm_history(db: firestore.client, user_id: str, topic: str) -> List[Dict[str, Any]]:
     """Fetches the last N quiz attempts for the topic to inform the Professor Agent."""
     if not db: 
         return []
     try:
-        ltm_ref = get_ltm_collection_ref(db, user_id)
-        query = ltm_ref.where('topic', '==', topic).order_by('timestamp', direction=firestore.Query.DESCENDING).limit(10)
-        
-        docs = query.stream()
-        history = []
-        for doc in docs:
-            data = doc.to_dict()
-            history.append({
-                'node': data.get('node_id'),
-                'status': data.get('status')
-            })
-        return history
+        return _fetch_ltm(db, _current_app_id(), user_id, topic)
     except Exception as e:
         logger.error("Failed to fetch LTM history: %s", e)
         return []
 
+#  STREAMING PREVIEW 
+
+def generate_with_preview(node_label: str, ltm_history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Runs content generation while rendering the lecture and quiz progress as they stream in."""
+    curriculum = st.session_state.curriculum
+    partials: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+    future = submit(st.session_state.agent_core.parallel_content_generation(
+        node_label, ltm_history, on_partial=partials.put, topic=curriculum.topic,
+        sibling_labels=[data.label for data in curriculum.nodes.values()]
+    ))
+    preview = st.empty()
+
+    # Partials arrive on the agent loop thread; only this script thread may touch Streamlit elements.
+    while not future.done():
+        try:
+            partial = partials.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        while not partials.empty():
+            partial = partials.get_nowait()
+        with preview.container():
+            st.caption("Drafting lecture... %d/10 quiz questions written" % len(partial.get('quiz_items', [])))
+            st.markdown(partial.get('content_text', ''))
+
+    preview.empty()
+    return future.result()
+
+#  SPECULATIVE PREFETCH 
+
+def start_prefetch(node_id: str, ltm_history: List[Dict[str, Any]]):
+    """
+    Speculatively generates the next likely module(s) while the user studies the current one.
+    Work is scheduled on the agents' long-lived event loop; no thread is created per prefetch.
+    Each entry records the LTM tag it was generated for, so take_prefetched can reject stale content.
+    """
+    curriculum = st.session_state.curriculum
+    prefetch = st.session_state.prefetch
+
+    for next_id in curriculum.next_candidates(node_id, PREFETCH_DEPTH):
+        key = (curriculum.topic, next_id)
+        if key in prefetch:
+            continue
+        node_label = curriculum.nodes[next_id].label
+        future = submit(st.session_state.agent_core.parallel_content_generation(
+            node_label, ltm_history, topic=curriculum.topic,
+            sibling_labels=[data.label for data in curriculum.nodes.values()]
+        ))
+        prefetch[key] = (AgentCore._summarize_ltm(ltm_history), future)
+        logger.info("Prefetch Trace: Scheduled content for %s.", node_label)
+
+def take_prefetched(node_id: str, ltm_history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Consumes prefetched content for a node, waiting for it if still in flight.
+    Content generated for a different LTM tag than the learner's current one is discarded.
+    """
+    entry = st.session_state.prefetch.pop((st.session_state.curriculum.topic, node_id), None)
+    if entry is None:
+        return None
+    ltm_summary, future = entry
+    if ltm_summary != AgentCore._summarize_ltm(ltm_history):
+        logger.info("Prefetch Trace: Discarded %s, generated for stale LTM tag %s.", node_id, ltm_summary)
+        return None
+    try:
+        if not future.done():
+            with st.spinner("Finishing prefetched module..."):
+                return future.result()
+        return future.result()
+    except Exception as e:
+        logger.error("Prefetch failed for %s: %s", node_id, e)
+        return None
+
+def discard_prefetches():
+    """
+    Drops all pending prefetches. In-flight generations are not cancelled: they may be coalesced
+    with a live request, and their results still land in the response cache.
+    """
+    st.session_state.prefetch.clear()
+
 #  SESSION STATE INITIALIZATION 
 
 if 'curriculum' not in st.session_state:
@@ -147,17 +280,35 @@ if 'current_node' not in st.session_state:
 if 'current_content' not in st.session_state:
     st.session_state.current_content = None
 if 'history' not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = collections.deque(maxlen=HISTORY_LIMIT)
 if 'initialized_model_name' not in st.session_state:
     st.session_state.initialized_model_name = None
 if 'quiz_answers' not in st.session_state:
     st.session_state.quiz_answers = {}
+if 'prefetch' not in st.session_state:
+    st.session_state.prefetch = {}
+if 'notifications' not in st.session_state:
+    st.session_state.notifications = []
+    st.session_state.celebrate = False
 
 db = st.session_state.db_client
 user_id = st.session_state.user_id
 
 #  UI COMPONENTS 
 
+def notify(message: str, icon: str):
+    """Queues a toast for the next run, so results survive st.rerun() without holding the server thread."""
+    st.session_state.notifications.append((message, icon))
+
+def render_notifications():
+    """Shows (and clears) queued toasts and any pending celebration."""
+    for message, icon in st.session_state.notifications:
+        st.toast(message, icon=icon)
+    st.session_state.notifications = []
+    if st.session_state.celebrate:
+        st.balloons()
+        st.session_state.celebrate = False
+
 def render_sidebar():
     """Renders configuration, metrics, and audit log in the sidebar."""
     
@@ -202,14 +353,20 @@ def render_sidebar():
         st.caption("User ID: %s" % user_id)
         
         # P3: Display Latency Metrics
-        if st.session_state.agent_core and st.session_state.agent_core.latency_metrics:
+        latency_metrics = st.session_state.agent_core.latency_metrics if st.session_state.agent_core else {}
+        if latency_metrics:
             st.markdown("#### P3: Parallel Agent Tracing")
-            for node, latency in st.session_state.agent_core.latency_metrics.items():
+            for node, latency in latency_metrics.items():
                 st.metric("%s Latency" % node, "%.2f s" % latency)
 
+        if st.session_state.agent_core:
+            cache_metrics = st.session_state.agent_core.cache_metrics
+            st.caption("Semantic Cache: %d hits / %d misses" % (cache_metrics['hits'], cache_metrics['misses']))
+
         with st.expander("Audit Log"):
-            for event in st.session_state.history:
-                st.text(event)
+            # Newest first, rendered as a single element rather than one widget per event
+            if st.session_state.history:
+                st.code("\n".join(reversed(st.session_state.history)), language=None)
 
 def render_initialization():
     """Renders the curriculum creation form."""
@@ -237,7 +394,7 @@ def render_initialization():
             if not st.session_state.curriculum.nodes:
                 with st.spinner("Architect Agent is designing the dependency graph..."):
                     try:
-                        graph_data = st.session_state.agent_core.architect_agent(topic, context_input)
+                        graph_data = run_sync(st.session_state.agent_core.architect_agent(topic, context_input))
                         if "error" in graph_data:
                             st.error("Generation Error: %s" % graph_data['error'])
                         else:
@@ -246,6 +403,8 @@ def render_initialization():
                             if db:
                                 save_curriculum_state(db, user_id, st.session_state.curriculum)
                             st.rerun()
+                    except ValueError as e:
+                        st.error("Invalid curriculum graph: %s" % e)
                     except Exception as e:
                         st.error("Agent Failure: %s" % e)
 
@@ -258,30 +417,31 @@ def render_module_view():
         st.subheader("Dependency Structure: %s" % st.session_state.curriculum.topic)
         st.graphviz_chart(st.session_state.curriculum.get_dot_graph())
         
-        available_nodes = [
-            (nid, data['label']) 
-            for nid, data in st.session_state.curriculum.nodes.items() 
-            if data['status'] == 'AVAILABLE'
-        ]
+        available_nodes = st.session_state.curriculum.get_available()
         
         if available_nodes and st.session_state.current_node is None:
             st.info("Select an available module to begin:")
             selected_node_id = st.selectbox(
                 "Available Modules", 
-                options=[n[0] for n in available_nodes],
-                format_func=lambda x: st.session_state.curriculum.nodes[x]['label']
+                options=available_nodes,
+                format_func=lambda x: st.session_state.curriculum.nodes[x].label
             )
             
             if st.button("Start Module"):
                 st.session_state.current_node = selected_node_id
                 st.session_state.quiz_answers = {} 
                 
-                with st.spinner("Multi-Agent System working: Professor, Proctor, LaTeX, and Verifier..."):
-                    node_label = st.session_state.curriculum.nodes[selected_node_id]['label']
-                    ltm_history = get_ltm_history(db, user_id, st.session_state.curriculum.topic)
-                    content = st.session_state.agent_core.parallel_content_generation(node_label, ltm_history)
-                    st.session_state.current_content = content
+                node_label = st.session_state.curriculum.nodes[selected_node_id].label
+                ltm_history = get_ltm_history(db, user_id, st.session_state.curriculum.topic)
+                content = take_prefetched(selected_node_id, ltm_history)
+                if content:
+                    st.session_state.history.append("Started module (prefetched): %s" % node_label)
+                else:
+                    with st.spinner("Multi-Agent System working: Professor, Proctor, LaTeX, and Verifier..."):
+                        content = generate_with_preview(node_label, ltm_history)
                     st.session_state.history.append("Started module: %s" % node_label)
+                st.session_state.current_content = content
+                start_prefetch(selected_node_id, ltm_history)
                 st.rerun()
         elif not available_nodes and not st.session_state.current_node:
             st.success("All required modules completed!")
@@ -289,7 +449,7 @@ def render_module_view():
     with tab_content:
         if st.session_state.current_node:
             node_id = st.session_state.current_node
-            node_label = st.session_state.curriculum.nodes[node_id]['label']
+            node_label = st.session_state.curriculum.nodes[node_id].label
             content = st.session_state.current_content
             
             st.header("Module: %s" % node_label)
@@ -363,21 +523,19 @@ def render_module_view():
                         
                         # 3. Trigger Evaluator Agent
                         with st.spinner("Processing results and checking for remediation..."):
-                            remedial_plan = st.session_state.agent_core.evaluator_agent(
+                            remedial_plan = run_sync(st.session_state.agent_core.evaluator_agent(
                                 node_label, 
                                 score_percentage, 
                                 verifier_audit # A2A SIGNAL
-                            )
+                            ))
                         
                         # 4. Handle Results (Pass/Fail)
                         if is_pass:
-                            st.balloons()
-                            st.success("Module Passed! Score: %.0f%% (%d/%d)" % (score_percentage * 100, correct_count, num_questions))
-                            log_quiz_attempt(db, user_id, node_id, True)
+                            st.session_state.celebrate = True
+                            notify("Module Passed! Score: %.0f%% (%d/%d)" % (score_percentage * 100, correct_count, num_questions), "✅")
                             st.session_state.curriculum.mark_completed(node_id)
                         else:
-                            st.error("Module Failed. Score: %.0f%% (%d/%d). Needs Remediation." % (score_percentage * 100, correct_count, num_questions))
-                            log_quiz_attempt(db, user_id, node_id, False)
+                            notify("Module Failed. Score: %.0f%% (%d/%d). Needs Remediation." % (score_percentage * 100, correct_count, num_questions), "🚨")
                             
                             if remedial_plan and not remedial_plan.get('error'):
                                 injected = st.session_state.curriculum.inject_remedial_node(
@@ -385,16 +543,14 @@ def render_module_view():
                                     remedial_plan
                                 )
                                 if injected:
-                                    st.warning("Curriculum Updated: Added remedial node '%s'" % remedial_plan['remedial_node_label'])
+                                    notify("Curriculum Updated: Added remedial node '%s'" % remedial_plan['remedial_node_label'], "⚠️")
                                     st.session_state.history.append("Remediation injected: %s" % remedial_plan['remedial_node_label'])
 
-                        # 5. Cleanup and Rerun
-                        if db:
-                            save_curriculum_state(db, user_id, st.session_state.curriculum)
+                        # 5. Persist (LTM attempt + curriculum state in one round-trip), Cleanup and Rerun
+                        commit_quiz_result(db, user_id, node_id, is_pass, st.session_state.curriculum)
                         st.session_state.current_node = None
                         st.session_state.current_content = None
                         st.session_state.quiz_answers = {}
-                        time.sleep(3)
                         st.rerun()
 
                 else:
@@ -407,6 +563,7 @@ st.set_page_config(layout="wide")
 st.title("Dynamic Curriculum Graph Generator")
 st.markdown("A multi-agent higher education system featuring: **A2A Protocol, Parallel Agents, LTM, and Custom Tools**.")
 
+render_notifications()
 render_sidebar()
 
 if not st.session_state.curriculum.nodes:
@@ -1,139 +1,389 @@
-import json
-from typing import List, Dict, Set, Optional, Any
+import sys
+from collections import deque
+from typing import Iterable, Iterator, List, Dict, Set, Optional, Any, Tuple
+
+import orjson
+
+# (fillcolor, fontcolor) per node status for the DOT view.
+_STATUS_STYLE = {
+    'COMPLETED': ("#d4edda", "#155724"),
+    'AVAILABLE': ("#cce5ff", "#004085"),
+    'LOCKED': ("#e2e3e5", "#383d41"),
+}
+_DEFAULT_STYLE = ("white", "black")
+
+_NODE_TMPL = '  "{id}" [label="{label}", fillcolor="{color}", fontcolor="{fontcolor}"];\n'
+_EDGE_TMPL = '  "{src}" -> "{tgt}";\n'
+# Escapes DOT quoted-string metacharacters so LLM-generated ids/labels cannot break the graph.
+_ESCAPE = str.maketrans({'"': '\\"', '\\': '\\\\'})
+
+class _NodeData:
+    """Per-node state. Slotted, so each node costs a small fixed-size object instead of a dict."""
+    __slots__ = ('label', 'status', 'unmet_count')
+
+    def __init__(self, label: str, status: str = 'LOCKED', unmet_count: int = 0):
+        self.label = label
+        self.status = status
+        self.unmet_count = unmet_count
+
+def _kahn_order(nodes: Dict[str, _NodeData], adjacency: Dict[str, Set[str]],
+                reverse_adjacency: Dict[str, Set[str]]) -> List[str]:
+    """Kahn's algorithm. Returns fewer ids than there are nodes iff the graph has a cycle."""
+    indegree = {nid: len(reverse_adjacency.get(nid, ())) for nid in nodes}
+    ready = deque(nid for nid, deg in indegree.items() if deg == 0)
+    order = []
+    while ready:
+        node_id = ready.popleft()
+        order.append(node_id)
+        for succ in sorted(adjacency.get(node_id, ())):
+            indegree[succ] -= 1
+            if indegree[succ] == 0:
+                ready.append(succ)
+    return order
+
+def _build_graph(graph_data: dict) -> Tuple[Dict[str, _NodeData], Dict[str, Set[str]], Dict[str, Set[str]], List[str]]:
+    """Builds node/edge maps and the topological order from Architect output. Raises ValueError if unusable."""
+    nodes: Dict[str, _NodeData] = {}
+    adjacency: Dict[str, Set[str]] = {}
+    reverse_adjacency: Dict[str, Set[str]] = {}
+
+    # Load Nodes
+    for node in graph_data.get('nodes', []):
+        nid = sys.intern(node['id'])
+        nodes[nid] = _NodeData(node['label'])
+        adjacency[nid] = set()
+        reverse_adjacency[nid] = set()
+    if not nodes:
+        raise ValueError("Curriculum graph has no nodes")
+
+    # Load Edges (duplicates in noisy Architect output collapse into the sets)
+    for edge in graph_data.get('edges', []):
+        src, tgt = sys.intern(edge['source']), sys.intern(edge['target'])
+        if src in nodes and tgt in nodes:
+            adjacency[src].add(tgt)
+            reverse_adjacency[tgt].add(src)
+
+    order = _kahn_order(nodes, adjacency, reverse_adjacency)
+    if len(order) != len(nodes):
+        blocked = sorted(set(nodes) - set(order))
+        raise ValueError("Curriculum graph contains a cycle; unreachable nodes: %s" % ", ".join(blocked))
+    return nodes, adjacency, reverse_adjacency, order
+
+def validate_graph(graph_data: Dict[str, Any]) -> Optional[str]:
+    """Returns why Architect output cannot be loaded (empty, cyclic, malformed), or None if it is usable."""
+    try:
+        _build_graph(graph_data)
+    except (ValueError, KeyError, TypeError) as e:
+        return str(e) if isinstance(e, ValueError) else "Malformed curriculum graph: %r" % e
+    return None
+
+# Fields written per node by serialize(); anything else on a stored node predates the current layout.
+_STORED_NODE_FIELDS = frozenset({'label', 'remedial_rank'})
 
 class CurriculumManager:
     """
     Manages the state of the Dynamic Curriculum Graph.
-    Designed for full serialization to Firestore (P1).
+    Designed for full serialization to Firestore (P1), with per-mutation deltas after the first write.
+    Edges are kept as id -> set maps rather than flat (CSR) arrays: graphs are small and are
+    mutated in place by remedial injection, which a compressed layout would have to rebuild.
     """
+    # One manager lives in every user session; slots drop the per-instance __dict__.
+    __slots__ = (
+        'nodes', 'adjacency', 'reverse_adjacency', 'completed_nodes', 'topic', 'context',
+        '_available', '_dot_cache', '_topo_idx', '_next_remedial_rank',
+        '_needs_full_write', '_dirty_nodes', '_completed_delta',
+    )
+
     def __init__(self):
-        self.nodes: Dict[str, dict] = {}
-        self.adjacency: Dict[str, List[str]] = {}
-        self.reverse_adjacency: Dict[str, List[str]] = {}
+        self.nodes: Dict[str, _NodeData] = {}
+        self.adjacency: Dict[str, Set[str]] = {}
+        self.reverse_adjacency: Dict[str, Set[str]] = {}
         self.completed_nodes: Set[str] = set()
         self.topic: Optional[str] = None
         self.context: Optional[str] = None
+        # Frontier of AVAILABLE node ids, kept in step with every status change.
+        self._available: Set[str] = set()
+        self._dot_cache: Optional[str] = None
+        # Topological rank per node (lower = earlier in the learning path); injected nodes get negative ranks.
+        self._topo_idx: Dict[str, int] = {}
+        self._next_remedial_rank = -1
+        # Change tracking since the last successful write (see serialize_delta / clear_deltas).
+        self._needs_full_write = True
+        self._dirty_nodes: Set[str] = set()
+        self._completed_delta: Set[str] = set()
+
+    def _stored_node(self, node_id: str) -> Dict[str, Any]:
+        """
+        Persisted form of a node. Status and unmet_count are derived from the graph on load, so only the
+        label is stored, plus the rank of injected remedial nodes (which topological order cannot recover).
+        """
+        stored: Dict[str, Any] = {'label': self.nodes[node_id].label}
+        rank = self._topo_idx.get(node_id, 0)
+        if rank < 0:
+            stored['remedial_rank'] = rank
+        return stored
 
     def serialize(self) -> Dict[str, Any]:
-        """Converts the object state into a JSON-friendly dictionary for Firestore."""
+        """
+        Converts the object state into a JSON-friendly dictionary for Firestore.
+        Full snapshot: only used for the first write of a graph; later writes use serialize_delta().
+        """
         return {
-            'nodes': self.nodes,
-            'adjacency': self.adjacency,
-            'reverse_adjacency': self.reverse_adjacency,
+            'nodes': {nid: self._stored_node(nid) for nid in self.nodes},
+            # Firestore has no set type; sorted lists keep stored documents stable.
+            'adjacency': {nid: sorted(targets) for nid, targets in self.adjacency.items()},
             'completed_nodes': list(self.completed_nodes),
             'topic': self.topic,
             'context': self.context
         }
 
+    def serialize_delta(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns only what changed since the last clear_deltas(): records and adjacency lists of
+        injected nodes, plus newly completed ids (for an array-union).
+        Returns None when no full snapshot has been written yet, in which case use serialize().
+        """
+        if self._needs_full_write:
+            return None
+        return {
+            'nodes_update': {nid: self._stored_node(nid) for nid in self._dirty_nodes},
+            'adjacency_update': {nid: sorted(self.adjacency[nid]) for nid in self._dirty_nodes},
+            'completed_arrayUnion': list(self._completed_delta)
+        }
+
+    def clear_deltas(self):
+        """Marks the current state as persisted. Call after a successful write."""
+        self._needs_full_write = False
+        self._dirty_nodes.clear()
+        self._completed_delta.clear()
+
+    def to_json(self) -> bytes:
+        """Encodes the full snapshot as JSON bytes (for caches and logs outside Firestore)."""
+        return orjson.dumps(self.serialize())
+
+    @classmethod
+    def from_json(cls, data: bytes):
+        """Inverse of to_json()."""
+        return cls.deserialize(orjson.loads(data))
+
     @classmethod
     def deserialize(cls, data: Dict[str, Any]):
         """Creates a CurriculumManager instance from Firestore data."""
         manager = cls()
-        manager.nodes = data.get('nodes', {})
-        manager.adjacency = data.get('adjacency', {})
-        manager.reverse_adjacency = data.get('reverse_adjacency', {})
-        manager.completed_nodes = set(data.get('completed_nodes', []))
+        # Older documents also carry status/unmet_count; both are recomputed below.
+        # Ids are interned on ingest so the many dict/set lookups below compare by pointer.
+        manager.nodes = {
+            sys.intern(nid): _NodeData(stored.get('label'))
+            for nid, stored in data.get('nodes', {}).items()
+        }
+        manager.adjacency = {
+            sys.intern(nid): {sys.intern(t) for t in targets}
+            for nid, targets in data.get('adjacency', {}).items()
+        }
+        # Not stored (it mirrors adjacency); rebuilt in O(E).
+        manager.reverse_adjacency = {nid: set() for nid in manager.nodes}
+        for src, targets in manager.adjacency.items():
+            for tgt in targets:
+                manager.reverse_adjacency.setdefault(tgt, set()).add(src)
+        manager.completed_nodes = {sys.intern(nid) for nid in data.get('completed_nodes', [])}
         manager.topic = data.get('topic')
         manager.context = data.get('context')
         manager._update_node_statuses()
+        manager._compute_topo_order({
+            sys.intern(nid): stored['remedial_rank']
+            for nid, stored in data.get('nodes', {}).items() if 'remedial_rank' in stored
+        })
+        manager.clear_deltas()
+        # Documents written before reverse_adjacency and per-node status/unmet_count were dropped still carry
+        # them, and deltas would never touch (or fix) those stale fields: rewrite the document once instead.
+        manager._needs_full_write = 'reverse_adjacency' in data or any(
+            not _STORED_NODE_FIELDS.issuperset(stored) for stored in data.get('nodes', {}).values()
+        )
         return manager
 
     def load_from_json(self, graph_data: dict, topic: str, context: str):
-        """Initializes the graph from the Architect Agent's output."""
-        self.nodes = {}
-        self.adjacency = {}
-        self.reverse_adjacency = {}
+        """
+        Initializes the graph from the Architect Agent's output.
+        Raises ValueError if the graph is empty or cyclic; the current graph is left untouched.
+        """
+        nodes, adjacency, reverse_adjacency, order = _build_graph(graph_data)
+
+        self.nodes = nodes
+        self.adjacency = adjacency
+        self.reverse_adjacency = reverse_adjacency
         self.completed_nodes = set()
-        self.topic = topic
-        self.context = context
-
-        # Load Nodes
-        for node in graph_data.get('nodes', []):
-            self.nodes[node['id']] = {
-                'label': node['label'],
-                'status': 'LOCKED' 
-            }
-            self.adjacency[node['id']] = []
-            self.reverse_adjacency[node['id']] = []
-
-        # Load Edges
-        for edge in graph_data.get('edges', []):
-            src, tgt = edge['source'], edge['target']
-            if src in self.nodes and tgt in self.nodes:
-                self.adjacency[src].append(tgt)
-                self.reverse_adjacency[tgt].append(src)
+        self.topic = sys.intern(topic)
+        self.context = sys.intern(context)
+        self.clear_deltas()
+        self._needs_full_write = True
 
         self._update_node_statuses()
+        self._topo_idx = {node_id: rank for rank, node_id in enumerate(order)}
+        self._next_remedial_rank = -1
+        self._touch()
 
     def _update_node_statuses(self):
-        """Recalculates status for all nodes."""
-        for node_id in self.nodes:
-            if node_id in self.completed_nodes:
-                self.nodes[node_id]['status'] = 'COMPLETED'
+        """
+        Recalculates unmet prerequisite counts and status for all nodes.
+        Full scan, only used when loading a graph. Counts are accumulated over the edge
+        list in one pass: a completed source's out-edges are skipped wholesale.
+        """
+        unmet = dict.fromkeys(self.nodes, 0)
+        for src, targets in self.adjacency.items():
+            if src in self.completed_nodes:
                 continue
+            for tgt in targets:
+                if tgt in unmet:
+                    unmet[tgt] += 1
+
+        self._available.clear()
+        for node_id, data in self.nodes.items():
+            data.unmet_count = unmet[node_id]
+            self._recompute_status(node_id)
+        self._dot_cache = None
+
+    def _compute_topo_order(self, remedial_ranks: Optional[Dict[str, int]] = None):
+        """
+        Ranks nodes topologically. Stored graphs are acyclic, but any node left on a cycle is ranked last.
+        'remedial_ranks' restores the (negative) ranks of injected nodes, so remediation stays first after a reload.
+        """
+        remedial_ranks = remedial_ranks or {}
+        # Injected nodes are ranked by their stored rank; their edges must not shift the tie-breaks among the
+        # original nodes either, or the picker order would change across a reload.
+        original = {nid: data for nid, data in self.nodes.items() if nid not in remedial_ranks}
+        reverse_adjacency = {
+            nid: {src for src in sources if src not in remedial_ranks}
+            for nid, sources in self.reverse_adjacency.items()
+        }
+        order = _kahn_order(original, self.adjacency, reverse_adjacency)
+        self._topo_idx = {node_id: rank for rank, node_id in enumerate(order)}
+        for node_id in self.nodes:
+            self._topo_idx.setdefault(node_id, len(self._topo_idx))
+        self._next_remedial_rank = -1
+        for node_id, rank in remedial_ranks.items():
+            if node_id in self._topo_idx:
+                self._topo_idx[node_id] = rank
+                self._next_remedial_rank = min(self._next_remedial_rank, rank - 1)
+
+    def _touch(self):
+        """Records a mutation: drops views derived from the old graph."""
+        self._dot_cache = None
 
-            prereqs = self.reverse_adjacency.get(node_id, [])
-            if not prereqs:
-                self.nodes[node_id]['status'] = 'AVAILABLE'
-            else:
-                all_met = all(p in self.completed_nodes for p in prereqs)
-                self.nodes[node_id]['status'] = 'AVAILABLE' if all_met else 'LOCKED'
+    def _recompute_status(self, node_id: str):
+        """Derives a single node's status from its unmet prerequisite count."""
+        data = self.nodes[node_id]
+        if node_id in self.completed_nodes:
+            data.status = 'COMPLETED'
+        else:
+            data.status = 'AVAILABLE' if data.unmet_count == 0 else 'LOCKED'
+        if data.status == 'AVAILABLE':
+            self._available.add(node_id)
+        else:
+            self._available.discard(node_id)
+
+    def get_available(self) -> List[str]:
+        """Ids of the modules the learner can start now, in topological order. Reads the frontier, not every node."""
+        return sorted(self._available, key=self._topo_idx.__getitem__)
 
     def mark_completed(self, node_id: str):
-        if node_id in self.nodes:
+        self.mark_completed_many([node_id])
+
+    def mark_completed_many(self, node_ids: Iterable[str]):
+        """
+        Completes several nodes as one mutation (e.g. a grading pass): each successor is re-evaluated
+        once, and serialize_delta() then carries all of them for a single batched Firestore write.
+        """
+        changed = False
+        touched: Set[str] = set()
+        for node_id in node_ids:
+            if node_id not in self.nodes or node_id in self.completed_nodes:
+                continue
+            changed = True
             self.completed_nodes.add(node_id)
-            self._update_node_statuses()
+            self.nodes[node_id].status = 'COMPLETED'
+            self._available.discard(node_id)
+            self._completed_delta.add(node_id)
+            # Each prerequisite is released exactly once, so only direct successors need a decrement.
+            for succ in self.adjacency.get(node_id, ()):
+                self.nodes[succ].unmet_count -= 1
+                touched.add(succ)
+
+        if changed:
+            for succ in touched:
+                self._recompute_status(succ)
+            self._touch()
+
+    def next_candidates(self, node_id: str, limit: int = 1) -> List[str]:
+        """
+        Predicts the modules most likely to be started after node_id: the children it
+        unlocks once completed, followed by the other currently AVAILABLE nodes, each in topological order.
+        """
+        candidates = []
+        releasing = 0 if node_id in self.completed_nodes else 1
+        for child in sorted(self.adjacency.get(node_id, ()), key=self._topo_idx.__getitem__):
+            if child in self.completed_nodes:
+                continue
+            if self.nodes[child].unmet_count - releasing == 0:
+                candidates.append(child)
+
+        for n_id in self.get_available():
+            if n_id != node_id and n_id not in candidates:
+                candidates.append(n_id)
+        return candidates[:limit]
 
     def inject_remedial_node(self, failed_node_id: str, remedial_data: dict) -> bool:
         """Dynamically alters the graph structure by inserting a new dependency."""
         new_id = remedial_data.get('remedial_node_id')
         new_label = remedial_data.get('remedial_node_label')
         
-        if not new_id or new_id in self.nodes:
+        if not new_id or new_id in self.nodes or failed_node_id not in self.nodes:
             return False 
+        new_id = sys.intern(new_id)
 
-        self.nodes[new_id] = {
-            'label': new_label,
-            'status': 'AVAILABLE' 
-        }
-        self.adjacency[new_id] = []
-        self.reverse_adjacency[new_id] = []
-
+        # The new node has no prerequisites, so it is AVAILABLE as created.
+        self.nodes[new_id] = _NodeData(new_label, 'AVAILABLE')
+        self._available.add(new_id)
         # New Node -> Failed Node (Dependency)
-        self.adjacency[new_id].append(failed_node_id)
-        self.reverse_adjacency[failed_node_id].append(new_id)
+        self.adjacency[new_id] = {failed_node_id}
+        self.reverse_adjacency[new_id] = set()
+        self.reverse_adjacency[failed_node_id].add(new_id)
+        self._dirty_nodes.add(new_id)
+        # Remediation comes before everything else; the most recent injection first.
+        self._topo_idx[new_id] = self._next_remedial_rank
+        self._next_remedial_rank -= 1
 
-        if failed_node_id in self.nodes:
-            self.nodes[failed_node_id]['status'] = 'LOCKED'
-
-        self._update_node_statuses()
+        # The only other affected node is the one it now gates, which gains an unmet prerequisite.
+        failed = self.nodes[failed_node_id]
+        failed.unmet_count += 1
+        if failed_node_id not in self.completed_nodes:
+            failed.status = 'LOCKED'
+            self._available.discard(failed_node_id)
+        self._touch()
         return True
 
-    def get_dot_graph(self) -> str:
-        """Returns Graphviz DOT string for visualization."""
-        dot = "digraph G {\n"
-        dot += "  rankdir=LR;\n"
-        dot += "  node [shape=box, style=filled, fontname=\"Helvetica\"];\n"
+    def iter_dot_graph(self) -> Iterator[str]:
+        """Yields the Graphviz DOT source line by line, for streaming large graphs without building one string."""
+        yield "digraph G {\n"
+        yield "  rankdir=LR;\n"
+        yield "  node [shape=box, style=filled, fontname=\"Helvetica\"];\n"
 
         for n_id, data in self.nodes.items():
-            color = "white"
-            fontcolor = "black"
-            if data['status'] == 'COMPLETED':
-                color = "#d4edda"
-                fontcolor = "#155724"
-            elif data['status'] == 'AVAILABLE':
-                color = "#cce5ff"
-                fontcolor = "#004085"
-            elif data['status'] == 'LOCKED':
-                color = "#e2e3e5"
-                fontcolor = "#383d41"
-            
-            label = data['label']
-            dot += f'  "{n_id}" [label="{label}", fillcolor="{color}", fontcolor="{fontcolor}"];\n'
+            color, fontcolor = _STATUS_STYLE.get(data.status, _DEFAULT_STYLE)
+            yield _NODE_TMPL.format(
+                id=n_id.translate(_ESCAPE),
+                label=str(data.label).translate(_ESCAPE),
+                color=color,
+                fontcolor=fontcolor
+            )
 
         for src, targets in self.adjacency.items():
-            for tgt in targets:
-                dot += f'  "{src}" -> "{tgt}";\n'
+            for tgt in sorted(targets):
+                yield _EDGE_TMPL.format(src=src.translate(_ESCAPE), tgt=tgt.translate(_ESCAPE))
+
+        yield "}"
 
-        dot += "}"
-        return dot
\ No newline at end of file
+    def get_dot_graph(self) -> str:
+        """Returns Graphviz DOT string for visualization, cached until the next mutation."""
+        if self._dot_cache is None:
+            self._dot_cache = "".join(self.iter_dot_graph())
+        return self._dot_cache
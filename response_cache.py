@@ -0,0 +1,114 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import AbstractSet, Dict, List, Any, Optional, Tuple
+
+import orjson
+
+# Cosine similarity required for a semantic hit, tuned per agent namespace.
+# Agents without an entry (verifier, evaluator) are never cached.
+DEFAULT_THRESHOLDS: Dict[str, float] = {
+    'architect': 0.95,
+    'module': 0.92,
+}
+DEFAULT_TTL_SECONDS = 86400
+MAX_ENTRIES_PER_NAMESPACE = 256
+
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def canonicalize(prompt: str) -> str:
+    """Normalizes whitespace that does not change a prompt's meaning, so equivalent prompts share a key."""
+    lines = [line.rstrip() for line in prompt.strip().splitlines()]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines))
+
+
+def prompt_key(prompt: str) -> str:
+    """Exact-match cache key for a prompt, hashed from its canonical form."""
+    return "resp:%s" % hashlib.blake2b(canonicalize(prompt).encode("utf-8"), digest_size=32).hexdigest()
+
+
+def normalize(vector: List[float]) -> List[float]:
+    """Scales an embedding to unit length so a dot product equals cosine similarity."""
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0.0:
+        return list(vector)
+    return [v / norm for v in vector]
+
+
+class SemanticCache:
+    """
+    In-process response cache for agent outputs, keyed by exact prompt hash and,
+    as a fallback, by embedding similarity within a namespace and scope.
+    Shared across sessions so repeated or paraphrased requests skip Gemini entirely.
+    """
+    def __init__(self, thresholds: Optional[Dict[str, float]] = None, ttl: int = DEFAULT_TTL_SECONDS):
+        self.thresholds = dict(thresholds or DEFAULT_THRESHOLDS)
+        self.ttl = ttl
+        # key -> (expires_at, embedding, scope, embedded text, payload)
+        self._entries: Dict[str, "OrderedDict[str, Tuple[float, List[float], str, str, bytes]]"] = {}
+        self._lock = threading.Lock()
+
+    def enabled(self, namespace: Optional[str]) -> bool:
+        return namespace is not None and namespace in self.thresholds
+
+    def get_exact(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the stored response for an identical prompt, if still fresh."""
+        with self._lock:
+            bucket = self._entries.get(namespace)
+            if not bucket or key not in bucket:
+                return None
+            expires_at, _, _, _, payload = bucket[key]
+            if expires_at < time.monotonic():
+                del bucket[key]
+                return None
+            bucket.move_to_end(key)
+        return orjson.loads(payload)
+
+    def get_similar(self, namespace: str, embedding: List[float], scope: str = "",
+                    exclude: AbstractSet[str] = frozenset()) -> Optional[Dict[str, Any]]:
+        """
+        Returns the closest fresh response in the same scope above the namespace threshold.
+        Entries whose embedded text is in 'exclude' (e.g. sibling concepts of the same graph) never match.
+        """
+        threshold = self.thresholds.get(namespace, 1.0)
+        now = time.monotonic()
+        best_key, best_score, best_payload = None, threshold, None
+
+        with self._lock:
+            bucket = self._entries.get(namespace)
+            if not bucket:
+                return None
+            for key, (expires_at, stored, stored_scope, text, payload) in list(bucket.items()):
+                if expires_at < now:
+                    del bucket[key]
+                    continue
+                if stored_scope != scope or text in exclude:
+                    continue
+                score = sum(a * b for a, b in zip(embedding, stored))
+                if score >= best_score:
+                    best_key, best_score, best_payload = key, score, payload
+            if best_key is None:
+                return None
+            bucket.move_to_end(best_key)
+        return orjson.loads(best_payload)
+
+    def put(self, namespace: str, key: str, embedding: List[float], result: Dict[str, Any], scope: str = "",
+            text: str = ""):
+        """Stores a successful response with the text it was embedded from; error results are never cached."""
+        if "error" in result:
+            return
+        payload = orjson.dumps(result)
+        with self._lock:
+            bucket = self._entries.setdefault(namespace, OrderedDict())
+            bucket[key] = (time.monotonic() + self.ttl, embedding, scope, text, payload)
+            bucket.move_to_end(key)
+            while len(bucket) > MAX_ENTRIES_PER_NAMESPACE:
+                bucket.popitem(last=False)
+
+
+# Process-wide instance so cached responses are shared by every session.
+shared_cache = SemanticCache()
@@ -0,0 +1,125 @@
+import copy
+import random
+
+import pytest
+
+from curriculum_manager import CurriculumManager, validate_graph
+
+
+def _graph(n, density, seed):
+    rng = random.Random(seed)
+    nodes = [{'id': 'n%d' % i, 'label': 'Concept %d' % i} for i in range(n)]
+    edges = [{'source': 'n%d' % i, 'target': 'n%d' % j}
+             for i in range(n) for j in range(i + 1, n) if rng.random() < density]
+    return {'nodes': nodes, 'edges': edges}
+
+
+def _load(graph_data):
+    manager = CurriculumManager()
+    manager.load_from_json(graph_data, 'Topic', 'Context')
+    return manager
+
+
+def _statuses(manager):
+    return {nid: (data.status, data.unmet_count) for nid, data in manager.nodes.items()}
+
+
+def _apply_delta(stored, delta):
+    for field in ('nodes', 'adjacency'):
+        stored[field].update(copy.deepcopy(delta[field + '_update']))
+    stored['completed_nodes'] = sorted(set(stored['completed_nodes']) | set(delta['completed_arrayUnion']))
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_incremental_statuses_match_full_recompute(seed):
+    rng = random.Random(seed)
+    manager = _load(_graph(rng.randint(1, 12), 0.3, seed))
+
+    for step in range(10):
+        available = manager.get_available()
+        if not available:
+            break
+        node_id = rng.choice(available)
+        if rng.random() < 0.3:
+            manager.inject_remedial_node(node_id, {'remedial_node_id': 'r%d' % step, 'remedial_node_label': 'R'})
+        else:
+            manager.mark_completed(node_id)
+
+        # deserialize() derives every status from scratch in a single full pass
+        recomputed = CurriculumManager.deserialize(copy.deepcopy(manager.serialize()))
+        assert _statuses(manager) == _statuses(recomputed)
+        assert manager.get_available() == recomputed.get_available()
+        assert manager.get_dot_graph() == recomputed.get_dot_graph()
+
+
+def test_mark_completed_many_matches_sequential_completion():
+    graph_data = _graph(10, 0.3, 7)
+    one_by_one, batched = _load(graph_data), _load(graph_data)
+    ids = ['n0', 'n3', 'n3', 'missing', 'n5']
+    for node_id in ids:
+        one_by_one.mark_completed(node_id)
+    batched.mark_completed_many(ids)
+    assert _statuses(one_by_one) == _statuses(batched)
+
+
+def test_serialize_delta_after_injection_and_completion():
+    manager = _load({'nodes': [{'id': 'a', 'label': 'A'}, {'id': 'b', 'label': 'B'}],
+                     'edges': [{'source': 'a', 'target': 'b'}]})
+    assert manager.serialize_delta() is None  # nothing written yet: full snapshot required
+    stored = copy.deepcopy(manager.serialize())
+    manager.clear_deltas()
+
+    manager.mark_completed('a')
+    manager.inject_remedial_node('b', {'remedial_node_id': 'r', 'remedial_node_label': 'R'})
+    delta = manager.serialize_delta()
+    assert delta == {
+        'nodes_update': {'r': {'label': 'R', 'remedial_rank': -1}},
+        'adjacency_update': {'r': ['b']},
+        'completed_arrayUnion': ['a'],
+    }
+
+    _apply_delta(stored, delta)
+    manager.clear_deltas()
+    assert stored == manager.serialize()
+    assert manager.serialize_delta() == {'nodes_update': {}, 'adjacency_update': {}, 'completed_arrayUnion': []}
+
+
+def test_remedial_nodes_stay_first_after_reload():
+    manager = _load({'nodes': [{'id': 'a', 'label': 'A'}, {'id': 'b', 'label': 'B'}], 'edges': []})
+    manager.inject_remedial_node('b', {'remedial_node_id': 'r', 'remedial_node_label': 'R'})
+    reloaded = CurriculumManager.deserialize(copy.deepcopy(manager.serialize()))
+    assert manager.get_available() == reloaded.get_available() == ['r', 'a']
+
+
+@pytest.mark.parametrize("legacy", [
+    {'reverse_adjacency': {'a': [], 'b': ['a']}},
+    {'nodes': {'a': {'label': 'A', 'status': 'COMPLETED', 'unmet_count': 0},
+               'b': {'label': 'B', 'status': 'AVAILABLE', 'unmet_count': 0}}},
+])
+def test_legacy_documents_are_rewritten_once(legacy):
+    current = _load({'nodes': [{'id': 'a', 'label': 'A'}, {'id': 'b', 'label': 'B'}],
+                     'edges': [{'source': 'a', 'target': 'b'}]})
+    current.mark_completed('a')
+    document = dict(copy.deepcopy(current.serialize()), **legacy)
+
+    manager = CurriculumManager.deserialize(document)
+    assert manager.serialize_delta() is None
+    assert 'reverse_adjacency' not in manager.serialize()
+    assert all(set(stored) == {'label'} for stored in manager.serialize()['nodes'].values())
+
+    manager.clear_deltas()
+    assert manager.serialize_delta() is not None
+    assert CurriculumManager.deserialize(current.serialize()).serialize_delta() is not None
+
+
+@pytest.mark.parametrize("graph_data", [
+    {'nodes': [], 'edges': []},
+    {'nodes': [{'id': 'a', 'label': 'A'}, {'id': 'b', 'label': 'B'}],
+     'edges': [{'source': 'a', 'target': 'b'}, {'source': 'b', 'target': 'a'}]},
+])
+def test_unusable_graphs_are_rejected_without_touching_state(graph_data):
+    assert validate_graph(graph_data) is not None
+    manager = _load({'nodes': [{'id': 'x', 'label': 'X'}], 'edges': []})
+    with pytest.raises(ValueError):
+        manager.load_from_json(graph_data, 'Other', 'Context')
+    assert list(manager.nodes) == ['x'] and manager.topic == 'Topic'
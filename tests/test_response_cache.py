@@ -0,0 +1,38 @@
+from response_cache import SemanticCache, normalize, prompt_key
+
+FIRST_LAW = normalize([1.0, 0.0, 0.1])
+SECOND_LAW = normalize([1.0, 0.0, 0.12])  # cosine ~0.9998 with FIRST_LAW
+
+
+def _cache():
+    cache = SemanticCache()
+    cache.put('module', prompt_key('First Law'), FIRST_LAW, {'content_text': 'first'}, 'Thermo|NONE', 'First Law')
+    return cache
+
+
+def test_exact_hit_ignores_insignificant_whitespace():
+    assert _cache().get_exact('module', prompt_key('  First Law  \n')) == {'content_text': 'first'}
+
+
+def test_semantic_hit_requires_same_scope():
+    cache = _cache()
+    assert cache.get_similar('module', SECOND_LAW, 'Thermo|NONE') == {'content_text': 'first'}
+    assert cache.get_similar('module', SECOND_LAW, 'Thermo|STRONG') is None
+    assert cache.get_similar('module', SECOND_LAW, 'Chemistry|NONE') is None
+
+
+def test_semantic_hit_never_returns_a_sibling_concept():
+    cache = _cache()
+    assert cache.get_similar('module', SECOND_LAW, 'Thermo|NONE', exclude=frozenset({'First Law'})) is None
+
+
+def test_error_results_are_not_cached():
+    cache = SemanticCache()
+    cache.put('architect', 'k', FIRST_LAW, {'error': 'boom'})
+    assert cache.get_exact('architect', 'k') is None
+
+
+def test_hits_are_independent_copies():
+    cache = _cache()
+    cache.get_exact('module', prompt_key('First Law'))['content_text'] = 'mutated'
+    assert cache.get_exact('module', prompt_key('First Law')) == {'content_text': 'first'}
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from agent_core import parse_partial_json, repair_json
+
+
+@pytest.mark.parametrize("buffer, expected", [
+    # truncated strings are terminated
+    ('{"c": "hel', {'c': 'hel'}),
+    # a dangling escape is dropped, a completed one is kept
+    ('{"c": "a\\', {'c': 'a'}),
+    ('{"c": "say \\"hi', {'c': 'say "hi'}),
+    # dangling keys are cut back, a key awaiting its value gets null
+    ('{"c": "x", "q', {'c': 'x'}),
+    ('{"c": "x", "l":', {'c': 'x', 'l': None}),
+    ('{"c": "x",', {'c': 'x'}),
+    # partial literals and numbers are cut back to the last valid point
+    ('{"c": "x", "r": tru', {'c': 'x'}),
+    ('{"r": 0.', {}),
+    # nested containers are closed in order
+    ('{"q":[{"qt":"a","o":["A) x","B', {'q': [{'qt': 'a', 'o': ['A) x', 'B']}]}),
+    ('{"a": {"b": [1, 2', {'a': {'b': [1, 2]}}),
+])
+def test_parse_partial_json_repairs_truncated_objects(buffer, expected):
+    assert parse_partial_json(buffer) == expected
+
+
+def test_repair_json_leaves_complete_documents_alone():
+    document = '{"c": "x", "q": [{"qt": "a", "ci": 0}]}'
+    assert repair_json(document) == document
+
+
+@pytest.mark.parametrize("buffer", ['', '[1,2'])
+def test_parse_partial_json_only_returns_objects(buffer):
+    assert parse_partial_json(buffer) is None